@@ -12,20 +12,37 @@
     vivo.mydomain.edu 1 University; 2 colleges; 5 departments; 273 people; 3317 works; 268377 triples in language en
     98.40 seconds
 
+    When a seed is given in the properties file, the output is fully deterministic.  With a cache_dir as well, it is
+    kept in a local cache keyed by the properties, the seed and the version of sample-data-generator.py.  Running again
+    with the same properties copies the cached output instead of generating it again.
+
+    When binary_dump is set, the data is also written as a binary dump, which can later be converted to N-Triples or
+    Turtle, whole or in chunks, with --convert.
+
+    When the properties file has [University:name] sections, one university is generated for each section, in
+    parallel, sharing concepts and journals.  See sdg.properties.
+
 """
 
-from rdflib import Graph, Literal, Namespace, URIRef
+from rdflib import Dataset, Graph, Literal, Namespace, URIRef
 from rdflib.namespace import RDF, RDFS, XSD, SKOS
 from numpy import random
+import numpy
 import string
 import re
+import argparse
+import concurrent.futures
 import configparser
+import hashlib
+import os
+import shutil
+import tempfile
 import time
 
 __author__ = "Michael Conlon"
 __copyright__ = "Copyright (c) 2020 Michael Conlon"
 __license__ = "Apache-2"
-__version__ = "0.1.4"
+__version__ = "0.1.6"
 
 # globals
 
@@ -36,6 +53,7 @@ skos = Namespace('http://www.w3.org/2004/02/skos/core#')
 prov = Namespace('http://www.w3.org/ns/prov#')
 obo = Namespace('http://purl.obolibrary.org/obo/')
 owl = Namespace('http://www.w3.org/2002/07/owl#')
+prefixes = [("vivo", vivo), ("bibo", bibo), ("vcard", vcard), ("obo", obo), ("owl", owl)]
 g = Graph()
 ns = "http://vivo.mydomain.edu/individual/"
 first_names = ["a", "b", "c"]
@@ -45,8 +63,9 @@ lang = "en"
 content_langs = []
 concept_uris = []
 journal_uris = []
-author_uris = set()
+author_uris = {}  # insertion ordered, so that seeded runs select the same co-authors
 work_uris = []
+work_ranks = []
 site_dns = re.compile('^(?:https?:\/\/)?(?:[^@\n]+@)?(?:www\.)?([^:\/\n?]+)').match(ns)[1]
 titles = []
 work_types = [URIRef(bibo.AcademicArticle), URIRef(vivo.BlogPosting), URIRef(bibo.Book), URIRef(bibo.BookSection),
@@ -59,9 +78,9 @@ work_types = [URIRef(bibo.AcademicArticle), URIRef(vivo.BlogPosting), URIRef(bib
 work_type_cumulative_probabilities = []
 
 
-def make_uri(tag):
+def make_uri(tag, namespace=None):
     global ns
-    uri = URIRef(ns + tag + str(random.randint(1000000, 9999999)))
+    uri = URIRef((namespace or ns) + tag + str(random.randint(1000000, 9999999)))
     return uri
 
 
@@ -231,7 +250,7 @@ def add_work(self, p_uri):
     global journal_uris
     global author_uris
 
-    author_uris.add(p_uri)
+    author_uris.setdefault(p_uri)
     w_uri = make_uri('work')
     self.add((w_uri, URIRef(RDF.type), make_work_type()))
 
@@ -344,7 +363,7 @@ def add_coauthors(self, w_uri):
             self.add((a_uri, URIRef(vivo.relates), p_uri))
             self.add((a_uri, URIRef(vivo.relates), w_uri))
             self.add((a_uri, URIRef(vivo.rank), Literal(str(rank), datatype=XSD.integer)))
-    return
+    return rank
 
 
 def add_date_interval(self, start, end):
@@ -516,7 +535,246 @@ Graph.add_presentation = add_presentation
 Graph.add_course = add_course
 
 
-def main():
+# properties that choose where and how the data is written, but not the data itself.  They are left out of the cache
+# key, so changing them reuses the cached data
+
+OUTPUT_PROPERTIES = {"cache_dir", "binary_dump", "multi_university_output"}
+
+
+def make_cache_key(config, seed):
+    """
+    Hash the effective configuration, the seed and the generator version.  Keys are lower cased by configparser, and
+    sections and keys are sorted, so reordering the properties file does not change the key.
+    """
+    digest = hashlib.sha256()
+    digest.update(("version=" + __version__ + "\n" + "seed=" + str(seed) + "\n").encode("utf-8"))
+    for section in sorted(config.sections()):
+        digest.update(("[" + section + "]\n").encode("utf-8"))
+        for key, value in sorted(config.items(section)):
+            if key not in OUTPUT_PROPERTIES:
+                digest.update((key + "=" + value.strip() + "\n").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def read_cache(cache_dir, key, file_names, derive_outputs=None):
+    """
+    Copy cached output files for key to their paths.  Files are cached under their base names, so a path may name any
+    directory.  Files not in the cache are made by derive_outputs(entry_dir, missing) from the cached files, if it can,
+    and added to the cache.  Return the cached summary line, or None on a miss.
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    summary_path = os.path.join(entry_dir, "summary.txt")
+    if not os.path.isfile(summary_path):
+        return None
+    missing = [x for x in file_names if not os.path.isfile(os.path.join(entry_dir, os.path.basename(x)))]
+    if missing and (derive_outputs is None or not derive_outputs(entry_dir, missing)):
+        return None
+    for file_name in file_names:
+        if file_name in missing:
+            tmp_path = os.path.join(entry_dir, os.path.basename(file_name) + ".tmp")
+            shutil.copyfile(file_name, tmp_path)
+            os.replace(tmp_path, os.path.join(entry_dir, os.path.basename(file_name)))
+        else:
+            shutil.copyfile(os.path.join(entry_dir, os.path.basename(file_name)), file_name)
+    with open(summary_path) as f:
+        return f.read().strip()
+
+
+def write_cache(cache_dir, key, file_names, summary):
+    """
+    Store output files, under their base names, and the summary line for key.  The entry is built in a temporary
+    directory and renamed into place, so an interrupted run never leaves a partial entry behind.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_dir = os.path.join(cache_dir, key)
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        for file_name in file_names:
+            shutil.copyfile(file_name, os.path.join(tmp_dir, os.path.basename(file_name)))
+        with open(os.path.join(tmp_dir, "summary.txt"), "w") as f:
+            print(summary, file=f)
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # a copy failed, or another run stored the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(entry_dir):
+            raise
+
+
+# binary dump.  A term dictionary followed by an array of integer triples:
+#
+#   magic        8 bytes
+#   header       uint64[3]          number of terms, number of triples, length of the term text
+#   kinds        uint8[terms]       TERM_URI, TERM_LITERAL, TERM_BNODE or TERM_LANG
+#   meta         int32[terms]       for literals, id of the datatype uri or language tag term, otherwise -1
+#   offsets      int64[terms + 1]   start of each term in the term text
+#   text         uint8[length]      utf-8 term text
+#   padding      to a multiple of 8 bytes
+#   triples      int32[triples, 3]  subject, predicate and object term ids
+#
+# All numbers are little endian.  Every array is written and read in bulk, and read_binary_dump memory maps them.
+
+BINARY_DUMP_MAGIC = b"SDGB0001"
+TERM_URI = 0
+TERM_LITERAL = 1
+TERM_BNODE = 2
+TERM_LANG = 3
+
+
+def write_binary_dump(self, path):
+    term_ids = {}
+    kinds = []
+    meta = []
+    texts = []
+
+    def term_id(kind, text, term_meta=-1):
+        key = (kind, text, term_meta)
+        tid = term_ids.get(key)
+        if tid is None:
+            tid = len(kinds)
+            term_ids[key] = tid
+            kinds.append(kind)
+            meta.append(term_meta)
+            texts.append(text.encode("utf-8"))
+        return tid
+
+    def node_id(node):
+        if isinstance(node, Literal):
+            if node.language is not None:
+
+                # the same language tag rewrite as the Turtle output, so that both serializations agree
+
+                return term_id(TERM_LITERAL, str(node), term_id(TERM_LANG, node.language.replace("_", "-")))
+            if node.datatype is not None:
+                return term_id(TERM_LITERAL, str(node), term_id(TERM_URI, str(node.datatype)))
+            return term_id(TERM_LITERAL, str(node))
+        if isinstance(node, URIRef):
+            return term_id(TERM_URI, str(node))
+        return term_id(TERM_BNODE, str(node))
+
+    triples = numpy.empty((len(self), 3), dtype="<i4")
+    for i, (s, p, o) in enumerate(self):
+        triples[i] = (node_id(s), node_id(p), node_id(o))
+
+    # rdflib returns triples in hash order, which differs from run to run.  Renumber the terms in sorted order and sort
+    # the triples, so that the same graph always gives the same dump
+
+    order = sorted(range(len(kinds)), key=lambda x: (kinds[x], texts[x], kinds[meta[x]] if meta[x] >= 0 else -1,
+                                                     texts[meta[x]] if meta[x] >= 0 else b""))
+    new_ids = numpy.empty(len(kinds) + 1, dtype="<i4")
+    new_ids[order] = numpy.arange(len(kinds), dtype="<i4")
+    new_ids[-1] = -1
+    kinds = numpy.array(kinds, dtype="u1")[order]
+    meta = new_ids[numpy.array(meta, dtype=numpy.int64)[order]]
+    texts = [texts[x] for x in order]
+    triples = new_ids[triples]
+    triples = triples[numpy.lexsort((triples[:, 2], triples[:, 1], triples[:, 0]))]
+
+    lengths = numpy.array([len(x) for x in texts], dtype="<i8")
+    offsets = numpy.zeros(len(texts) + 1, dtype="<i8")
+    numpy.cumsum(lengths, out=offsets[1:])
+    with open(path, "wb") as f:
+        f.write(BINARY_DUMP_MAGIC)
+        numpy.array([len(kinds), len(triples), offsets[-1]], dtype="<u8").tofile(f)
+        kinds.tofile(f)
+        meta.tofile(f)
+        offsets.tofile(f)
+        f.write(b"".join(texts))
+        f.write(b"\0" * (-f.tell() % 8))
+        triples.tofile(f)
+    return len(triples)
+
+
+Graph.write_binary_dump = write_binary_dump
+
+
+def read_binary_dump(path):
+    """
+    Memory map a binary dump.  Return the arrays kinds, meta, offsets, text and triples as described above.  Nothing is
+    copied into memory until it is used.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(BINARY_DUMP_MAGIC)) != BINARY_DUMP_MAGIC:
+            raise ValueError(path + " is not a binary dump written by sample-data-generator.py")
+    position = len(BINARY_DUMP_MAGIC)
+    n_terms, n_triples, n_text = (int(x) for x in numpy.memmap(path, dtype="<u8", mode="r", offset=position, shape=3))
+    position += 24
+    arrays = []
+    for dtype, shape in [("u1", n_terms), ("<i4", n_terms), ("<i8", n_terms + 1), ("u1", n_text)]:
+        arrays.append(numpy.memmap(path, dtype=dtype, mode="r", offset=position, shape=shape) if shape else
+                      numpy.empty(0, dtype=dtype))
+        position += numpy.dtype(dtype).itemsize * shape
+    position += -position % 8
+    arrays.append(numpy.memmap(path, dtype="<i4", mode="r", offset=position, shape=(n_triples, 3)) if n_triples else
+                  numpy.empty((0, 3), dtype="<i4"))
+    return tuple(arrays)
+
+
+def escape_nt(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r")
+
+
+def dump_terms_nt(kinds, meta, offsets, text):
+    """
+    Decode the term dictionary of a binary dump into N-Triples terms, one entry per term id
+    """
+    raw = bytes(text)
+    offsets = offsets.tolist()
+    kinds = kinds.tolist()
+    meta = meta.tolist()
+    values = [raw[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(kinds))]
+    terms = [None] * len(values)
+    for i, kind in enumerate(kinds):
+        if kind == TERM_URI:
+            terms[i] = "<" + values[i] + ">"
+        elif kind == TERM_BNODE:
+            terms[i] = "_:" + values[i]
+        elif kind == TERM_LANG:
+            terms[i] = values[i]
+    for i, kind in enumerate(kinds):
+        if kind == TERM_LITERAL:
+            literal = '"' + escape_nt(values[i]) + '"'
+            if meta[i] >= 0:
+                literal += ("@" if kinds[meta[i]] == TERM_LANG else "^^") + terms[meta[i]]
+            terms[i] = literal
+    return numpy.array(terms, dtype=object)
+
+
+def convert_binary_dump(path, output, output_format="nt", chunk_triples=0):
+    """
+    Convert a binary dump to N-Triples or Turtle.  With chunk_triples, the output is split into files of at most that
+    many triples, named output_1, output_2, ...  Each chunk is complete, no triple is broken across files.  Return the
+    names of the files written.
+    """
+    kinds, meta, offsets, text, triples = read_binary_dump(path)
+    terms = dump_terms_nt(kinds, meta, offsets, text)
+    chunk_triples = chunk_triples if chunk_triples > 0 else max(len(triples), 1)
+    n_chunks = max(1, -(-len(triples) // chunk_triples))
+    file_names = []
+    for chunk in range(n_chunks):
+        if n_chunks == 1:
+            file_name = output + "." + output_format
+        else:
+            file_name = output + "_" + str(chunk + 1) + "." + output_format
+        rows = numpy.asarray(triples[chunk * chunk_triples:(chunk + 1) * chunk_triples])
+        lines = terms[rows[:, 0]] + " " + terms[rows[:, 1]] + " " + terms[rows[:, 2]] + " .\n"
+        if output_format == "nt":
+            with open(file_name, "w", encoding="utf-8") as f:
+                f.writelines(lines.tolist())
+        else:
+            chunk_graph = Graph()
+            for prefix, namespace in prefixes:
+                chunk_graph.bind(prefix, namespace)
+            chunk_graph.parse(data="".join(lines.tolist()), format="nt")
+            chunk_graph.serialize(destination=file_name, format="turtle", encoding="utf-8")
+        file_names.append(file_name)
+    return file_names
+
+
+def read_settings(config):
+    """
+    Set the globals used by the add_ functions from the VIVO and SDG sections of config
+    """
     global ns
     global college_names
     global department_names
@@ -524,16 +782,10 @@ def main():
     global last_names
     global lang
     global content_langs
-    global concept_uris
-    global journal_uris
     global titles
     global site_dns
-    global work_uris
     global work_type_cumulative_probabilities
 
-    start = time.time()
-    config = configparser.ConfigParser()
-    config.read("sdg.properties")
     ns = config.get("VIVO", "ns")
     site_dns = re.compile('^(?:https?:\/\/)?(?:[^@\n]+@)?(?:www\.)?([^:\/\n?]+)').match(ns)[1]
     first_names = config.get("SDG", "first_names").replace(" ", "").split(",")
@@ -561,19 +813,10 @@ def main():
         p += x
         work_type_cumulative_probabilities.append(p)
 
-    min_colleges_per_university = int(config.get("SDG", "min_colleges_per_university"))
-    max_colleges_per_university = int(config.get("SDG", "max_colleges_per_university"))
-    min_departments_per_college = int(config.get("SDG", "min_departments_per_college"))
-    max_departments_per_college = int(config.get("SDG", "max_departments_per_college"))
-    min_faculty_per_department = int(config.get("SDG", "min_faculty_per_department"))
-    max_faculty_per_department = int(config.get("SDG", "Max_faculty_per_department"))
-    min_works_per_faculty = int(config.get("SDG", "min_works_per_faculty"))
-    max_works_per_faculty = int(config.get("SDG", "max_works_per_faculty"))
 
-    n_colleges = 0
-    n_departments = 0
-    n_people = 0
-    n_works = 0
+def add_vocabularies(self, config):
+    global concept_uris
+    global journal_uris
 
     # add concepts, collect concept uris
 
@@ -581,8 +824,8 @@ def main():
     concepts = [x.strip() for x in concepts]
     for concept in concepts:
         c_uri = make_uri('concept')
-        g.add((c_uri, URIRef(RDF.type), URIRef(SKOS.Concept)))
-        g.add((c_uri, URIRef(RDFS.label), Literal(concept, lang=lang)))
+        self.add((c_uri, URIRef(RDF.type), URIRef(SKOS.Concept)))
+        self.add((c_uri, URIRef(RDFS.label), Literal(concept, lang=lang)))
         concept_uris.append(c_uri)
 
     # add journals, collect journal uris
@@ -591,30 +834,101 @@ def main():
     journals = [x.strip() for x in journals]
     for journal in journals:
         j_uri = make_uri('journal')
-        g.add((j_uri, URIRef(RDF.type), URIRef(bibo.Journal)))
-        g.add((j_uri, URIRef(RDFS.label), Literal(journal, lang=lang)))
-        g.add((j_uri, URIRef(bibo.issn),
-               Literal(str(random.randint(1000, 9999)) + '-' + str(random.randint(1000, 9999)), datatype=XSD.string)))
+        self.add((j_uri, URIRef(RDF.type), URIRef(bibo.Journal)))
+        self.add((j_uri, URIRef(RDFS.label), Literal(journal, lang=lang)))
+        self.add((j_uri, URIRef(bibo.issn),
+                  Literal(str(random.randint(1000, 9999)) + '-' + str(random.randint(1000, 9999)),
+                          datatype=XSD.string)))
         journal_uris.append(j_uri)
 
+
+Graph.add_vocabularies = add_vocabularies
+
+
+def sample_indices(populations, sizes, offsets=0):
+    """
+    Draw a batch of index sets without replacement, using Robert Floyd's algorithm.  Set i holds
+    min(sizes[i], populations[i]) distinct indices from range(offsets[i], offsets[i] + populations[i]).  A set of k
+    indices costs k random numbers and O(k^2) comparisons however large the population, and the whole batch is drawn
+    one column at a time.  This suits the small sets of relationship participants.  For a single large set, use
+    random.choice(n, k, replace=False).  populations and offsets may be scalars.  Return a list of index arrays.
+    """
+    sizes = numpy.asarray(sizes, dtype=numpy.int64)
+    populations = numpy.broadcast_to(numpy.asarray(populations, dtype=numpy.int64), sizes.shape)
+    offsets = numpy.broadcast_to(numpy.asarray(offsets, dtype=numpy.int64), sizes.shape)
+    sizes = numpy.minimum(sizes, populations)
+    k_max = int(sizes.max()) if len(sizes) else 0
+    samples = numpy.zeros((len(sizes), k_max), dtype=numpy.int64)
+    for j in range(k_max):
+
+        # draw from [0, upper].  If the draw is already in the set, take upper, which cannot be.  Columns past the
+        # size of a set are filled too, and dropped below
+
+        upper = populations - sizes + j
+        draw = numpy.minimum((random.random_sample(len(sizes)) * (upper + 1)).astype(numpy.int64), upper)
+        seen = (samples[:, :j] == draw[:, None]).any(axis=1)
+        samples[:, j] = numpy.where(seen, upper, draw)
+    return [offsets[i] + samples[i, :sizes[i]] for i in range(len(sizes))]
+
+
+def sample_local_indices(local, ranges, starts, populations, sizes):
+    """
+    Like sample_indices, but where local[i] is True and range ranges[i] of (starts, populations) is not empty, set i is
+    drawn from that range only.  Used to keep participants within one college.
+    """
+    local_populations = populations[ranges]
+    local = local & (local_populations > 0)
+    return sample_indices(numpy.where(local, local_populations, populations.sum()), sizes,
+                          numpy.where(local, starts[ranges], 0))
+
+
+def generate_university(self, config):
+    """
+    Add a university with colleges and departments and people and scholarly works, followed by projects, grants,
+    equipment, events and co-authors.  Concepts and journals must already be in concept_uris and journal_uris.
+    Return the counts of what was generated.
+    """
+    global work_uris
+
+    min_colleges_per_university = int(config.get("SDG", "min_colleges_per_university"))
+    max_colleges_per_university = int(config.get("SDG", "max_colleges_per_university"))
+    min_departments_per_college = int(config.get("SDG", "min_departments_per_college"))
+    max_departments_per_college = int(config.get("SDG", "max_departments_per_college"))
+    min_faculty_per_department = int(config.get("SDG", "min_faculty_per_department"))
+    max_faculty_per_department = int(config.get("SDG", "Max_faculty_per_department"))
+    min_works_per_faculty = int(config.get("SDG", "min_works_per_faculty"))
+    max_works_per_faculty = int(config.get("SDG", "max_works_per_faculty"))
+
+    n_colleges = 0
+    n_departments = 0
+    n_people = 0
+    n_works = 0
+
     # generate a university with colleges and departments and people and scholarly works
 
-    u_uri = g.add_university(config.get("SDG", "university_name"))
+    u_uri = self.add_university(config.get("SDG", "university_name"))
 
     person_uris = []
     college_uris = []
 
+    # people and works are created college by college, so those of a college are a contiguous range of indices
+
+    college_person_starts = []
+    college_work_starts = []
+
     for i in range(random.randint(min_colleges_per_university, max_colleges_per_university + 1)):
-        c_uri = g.add_college(college_names[random.randint(0, len(college_names) - 1)], u_uri)
+        c_uri = self.add_college(college_names[random.randint(0, len(college_names) - 1)], u_uri)
         college_uris.append(c_uri)
+        college_person_starts.append(len(person_uris))
+        college_work_starts.append(len(work_uris))
         n_colleges += 1
 
         for j in range(random.randint(min_departments_per_college, max_departments_per_college + 1)):
-            d_uri = g.add_department(department_names[random.randint(0, len(department_names) - 1)], c_uri)
+            d_uri = self.add_department(department_names[random.randint(0, len(department_names) - 1)], c_uri)
             n_departments += 1
 
             for k in range(random.randint(min_faculty_per_department, max_faculty_per_department + 1)):
-                p_uri = g.add_person(d_uri)
+                p_uri = self.add_person(d_uri)
                 person_uris.append(p_uri)
                 n_people += 1
                 print("Adding person", n_people)
@@ -627,12 +941,22 @@ def main():
                     a = int(a[0])
 
                 for w in range(random.randint(min_works_per_faculty, min_works_per_faculty + a)):
-                    w_uri = g.add_work(p_uri)
+                    w_uri = self.add_work(p_uri)
                     work_uris.append(w_uri)
                     n_works += 1
 
     print("People", n_people, "Works", n_works)
 
+    # participants are drawn without replacement, in one batch per kind of relationship, as indices into these arrays
+
+    person_array = numpy.array(person_uris, dtype=object)
+    work_array = numpy.array(work_uris, dtype=object)
+    college_array = numpy.array(college_uris, dtype=object)
+    college_person_starts = numpy.array(college_person_starts, dtype=numpy.int64)
+    college_people = numpy.diff(numpy.append(college_person_starts, len(person_uris)))
+    college_work_starts = numpy.array(college_work_starts, dtype=numpy.int64)
+    college_works = numpy.diff(numpy.append(college_work_starts, len(work_uris)))
+
     # once all the authors and works are created, create projects, grants and equipment. After that, add co-authors and co-author stubs
 
     n_projects = int(config.get("SDG", "n_projects"))
@@ -640,12 +964,20 @@ def main():
     max_project_participants = int(config.get("SDG", "max_project_participants"))
     min_produced_work = int(config.get("SDG", "min_produced_work"))
     max_produced_work = int(config.get("SDG", "max_produced_work"))
+    project_locality = float(config.get("SDG", "project_locality", fallback="0"))
+
+    # a local project has its participants and produced works in a single college
+
+    project_colleges = random.randint(0, len(college_uris), n_projects)
+    local = random.random_sample(n_projects) < project_locality
+    participants = sample_local_indices(local, project_colleges, college_person_starts, college_people,
+                                        random.randint(min_project_participants, max_project_participants, n_projects))
+    produced_works = sample_local_indices(local, project_colleges, college_work_starts, college_works,
+                                          random.randint(min_produced_work, max_produced_work, n_projects))
 
     project_uris = []
     for proj_index in range(n_projects):
-        n_participants = random.randint(min_project_participants, max_project_participants)
-        n_produced_work = random.randint(min_produced_work, max_produced_work)
-        proj_uri = g.add_project(random.choice(person_uris, n_participants), random.choice(work_uris, n_produced_work))
+        proj_uri = self.add_project(person_array[participants[proj_index]], work_array[produced_works[proj_index]])
         project_uris.append(proj_uri)
         print(f"Added project {proj_index + 1}: {proj_uri}")
 
@@ -657,12 +989,27 @@ def main():
     max_fundraisers = int(config.get("SDG", "max_produced_work"))
     min_grant_participants = int(config.get("SDG", "min_grant_participants"))
     max_grant_participants = int(config.get("SDG", "max_grant_participants"))
+    grant_locality = float(config.get("SDG", "grant_locality", fallback="0"))
+
+    # a local grant supports works of one of the colleges administering it
+
+    project_array = numpy.array(project_uris, dtype=object)
+    administers = sample_indices(len(college_uris), random.randint(min_administers, max_administers, n_grants))
+    fundraisers = sample_indices(len(project_uris), random.randint(min_fundraisers, max_fundraisers, n_grants))
+
+    # Floyd's algorithm does not draw the members of a set in random order, so pick one at random.  A grant without
+    # administering colleges is never local
+
+    n_administering = numpy.array([len(x) for x in administers], dtype=numpy.int64)
+    picks = (random.random_sample(n_grants) * n_administering).astype(numpy.int64)
+    grant_colleges = numpy.array([x[pick] if len(x) else 0 for x, pick in zip(administers, picks)], dtype=numpy.int64)
+    local = (random.random_sample(n_grants) < grant_locality) & (n_administering > 0)
+    supportees = sample_local_indices(local, grant_colleges, college_work_starts, college_works,
+                                      random.randint(min_grant_participants, max_grant_participants, n_grants))
 
     for grant_index in range(n_grants):
-        n_administers = random.randint(min_administers, max_administers)
-        n_fundraisers = random.randint(min_fundraisers, max_fundraisers)
-        n_supportees = random.randint(min_grant_participants, max_grant_participants)
-        grant_uri = g.add_grant(random.choice(college_uris, n_administers), random.choice(project_uris, n_fundraisers), random.choice(work_uris, n_supportees))
+        grant_uri = self.add_grant(college_array[administers[grant_index]], project_array[fundraisers[grant_index]],
+                                   work_array[supportees[grant_index]])
         print(f"Added grant {grant_index + 1}: {grant_uri}")
 
 
@@ -670,9 +1017,11 @@ def main():
     min_supportees = int(config.get("SDG", "min_supportees"))
     max_supportees = int(config.get("SDG", "max_supportees"))
 
+    manufacturers = random.randint(0, len(college_uris), n_equipment)
+    equipees = sample_indices(len(college_uris), random.randint(min_supportees, max_supportees, n_equipment))
     for equipment_index in range(n_equipment):
-        n_equipees = random.randint(min_supportees, max_supportees)
-        equipment_uri = g.add_equipment(random.choice(college_uris, 1)[0], random.choice(college_uris, n_equipees))
+        equipment_uri = self.add_equipment(college_array[manufacturers[equipment_index]],
+                                           college_array[equipees[equipment_index]])
         print(f"Added equipment {equipment_index + 1}: {equipment_uri}")
 
     n_conferences = int(config.get("SDG", "n_conferences"))
@@ -680,52 +1029,336 @@ def main():
     n_presentations = int(config.get("SDG", "n_presentations"))
     min_event_participants = int(config.get("SDG", "min_event_participants"))
     max_event_participants = int(config.get("SDG", "max_event_participants"))
+    n_courses = int(config.get("SDG", "n_courses"))
+
+    # participants of all talks, presentations and courses, in the order the events are created
+
+    n_events = n_conferences * (n_invited_talks + n_presentations) + n_courses
+    event_participants = iter(sample_indices(len(person_uris), random.randint(min_event_participants,
+                                                                              max_event_participants, n_events)))
+
     for conference_index in range(n_conferences):
         sub_events_uris = []
 
         for invited_talk_index in range(n_invited_talks):
-            n_event_participants = random.randint(min_event_participants, max_event_participants)
-            invited_talk_uri = g.add_invited_talk(random.choice(person_uris, n_event_participants))
+            invited_talk_uri = self.add_invited_talk(person_array[next(event_participants)])
             sub_events_uris.append(invited_talk_uri)
             print(f"Added invited talk {invited_talk_index + 1}: {invited_talk_uri}")
 
         for presentation_index in range(n_presentations):
-            n_event_participants = random.randint(min_event_participants, max_event_participants)
-            presentation_uri = g.add_presentation(random.choice(person_uris, n_event_participants))
+            presentation_uri = self.add_presentation(person_array[next(event_participants)])
             sub_events_uris.append(presentation_uri)
             print(f"Added presentation {presentation_index + 1}: {presentation_uri}")
         
-        conference_uri = g.add_conference(sub_events_uris)
+        conference_uri = self.add_conference(sub_events_uris)
         print(f"Added conference {conference_index + 1}: {conference_uri}")
 
         for event_uri in sub_events_uris:
-            g.add((event_uri, URIRef(obo.BFO_0000050), URIRef(conference_uri)))
+            self.add((event_uri, URIRef(obo.BFO_0000050), URIRef(conference_uri)))
 
-    n_courses = int(config.get("SDG", "n_courses"))
     for course_index in range(n_courses):
-        n_event_participants = random.randint(min_event_participants, max_event_participants)
-        course_uri = g.add_course(random.choice(person_uris, n_event_participants))
+        course_uri = self.add_course(person_array[next(event_participants)])
         print(f"Added course {course_index + 1}: {course_uri}")
 
     nw_uri = 0
     for w_uri in work_uris:
         nw_uri += 1
-        g.add_coauthors(w_uri)
+        work_ranks.append(self.add_coauthors(w_uri))
         if nw_uri % 10 == 0:
             print("Adding coauthors for work", nw_uri)
 
-    with open("sample-data.ttl", "w") as f:
-        triples_string = g.serialize(format="ttl")
-        
-        for language_tag in content_langs:
-            language_tag_vivo_locale = language_tag.replace("_", "-")
-            triples_string = triples_string.replace(language_tag, language_tag_vivo_locale)
+    return n_colleges, n_departments, n_people, n_works, n_projects, n_grants, n_equipment
+
+
+Graph.generate_university = generate_university
+
+
+def write_output(self, file_name, output_format="ttl", graph_name=None, append=False):
+    """
+    Write the graph as Turtle, or as N-Quads in the named graph graph_name.  With append, N-Quads are added to the end
+    of the file.
+    """
+    triples_string = self.serialize(format="ttl" if output_format == "ttl" else "nt")
+
+    for language_tag in content_langs:
+        language_tag_vivo_locale = language_tag.replace("_", "-")
+        triples_string = triples_string.replace(language_tag, language_tag_vivo_locale)
+
+    with open(file_name, "a" if append else "w") as f:
+        if output_format == "ttl":
+            print(triples_string, file=f)
+        else:
+
+            # the nt serializer writes triples in hash order, which differs from run to run.  Sort them, so that the
+            # same graph always gives the same quads
+
+            f.writelines(line[:-1] + "<" + graph_name + "> .\n" for line in sorted(triples_string.splitlines()) if line)
+
+
+Graph.write_output = write_output
+
+
+def make_summary(counts, n_triples):
+    n_colleges, n_departments, n_people, n_works, n_projects, n_grants, n_equipment = counts
+    return " ".join(str(x) for x in [site_dns, "1 University;", n_colleges, "colleges;", n_departments, "departments;",
+                                     n_people, "people;", n_works, "works;", n_projects, "projects;", n_grants,
+                                     "grants;", n_equipment, "units of equipment;", n_triples, "triples in language",
+                                     lang])
+
+
+# multiple universities.  Each [University:name] section of the properties describes one university, with its own ns
+# and university_name, and optionally its own values for any SDG property.  The universities are generated in
+# parallel, one worker process per university, sharing one set of concepts and journals.
+
+UNIVERSITY_SECTION = "University:"
+
+
+def university_file_name(name, output_format):
+    return "sample-data-" + name + "." + ("ttl" if output_format == "ttl" else "nq")
+
+
+def university_output_files(config, sections):
+    if config.get("SDG", "multi_university_output", fallback="ttl").strip() == "ttl":
+        return ["sample-data-shared.ttl"] + [university_file_name(x[len(UNIVERSITY_SECTION):].strip(), "ttl")
+                                             for x in sections]
+    return ["sample-data.nq"]
+
+
+def university_config(properties, section):
+    """
+    Build the configuration of one university: the VIVO and SDG sections, overridden by the university's own section
+    """
+    config = configparser.ConfigParser()
+    config.read_dict({"VIVO": properties["VIVO"], "SDG": properties["SDG"]})
+    for key, value in properties[section].items():
+        config.set("VIVO" if key == "ns" else "SDG", key, value)
+    return config
+
+
+def generate_university_worker(properties, section, index, seed, shared_concept_uris, shared_journal_uris,
+                               output_format):
+    """
+    Generate one university in a worker process and write it to its own file.  Return what the parent needs for the
+    summary and for cross institution co-authors.
+    """
+    global concept_uris
+    global journal_uris
+    global author_uris
+    global work_uris
+    global work_ranks
+
+    # each university draws from its own random stream.  Without a seed, a forked worker would otherwise repeat the
+    # stream of every other worker
+
+    random.seed([int(seed), index + 1] if seed else None)
+    config = university_config(properties, section)
+    read_settings(config)
+    concept_uris = [URIRef(x) for x in shared_concept_uris]
+    journal_uris = [URIRef(x) for x in shared_journal_uris]
+    author_uris = {}
+    work_uris = []
+    work_ranks = []
+
+    graph = Graph()
+    for prefix, namespace in prefixes:
+        graph.bind(prefix, namespace)
+    counts = graph.generate_university(config)
+    name = section[len(UNIVERSITY_SECTION):].strip()
+    graph.write_output(university_file_name(name, output_format), output_format,
+                       config.get("SDG", "graph", fallback=ns))
+    return {"name": name, "ns": ns, "graph": config.get("SDG", "graph", fallback=ns),
+            "summary": make_summary(counts, len(graph)), "n_triples": len(graph),
+            "authors": [str(x) for x in author_uris], "works": [str(x) for x in work_uris], "ranks": work_ranks}
+
+
+def add_cross_institution_coauthors(results, fraction, output_format):
+    """
+    Give about fraction of the works of each university one additional co-author from another university.  The
+    authorships belong to the university of the work and are appended to its file, as N-Triples lines in Turtle output,
+    which Turtle accepts, or as N-Quads in its named graph.  Return the number of triples added.
+    """
+    n_triples = 0
+    if fraction <= 0 or len(results) < 2:
+        return n_triples
+    for i, result in enumerate(results):
+        others = [j for j in range(len(results)) if j != i and results[j]["authors"]]
+        if not others or not result["works"]:
+            continue
+        n_cross = random.binomial(len(result["works"]), min(fraction, 1.))
+        lines = []
+        for w in random.choice(len(result["works"]), n_cross, replace=False):
+            authors = results[others[random.randint(0, len(others))]]["authors"]
+            p_uri = URIRef(authors[random.randint(0, len(authors))])
+            w_uri = URIRef(result["works"][w])
+            a_uri = make_uri('authorship', result["ns"])
+            for triple in [(a_uri, URIRef(RDF.type), URIRef(vivo.Authorship)), (a_uri, URIRef(vivo.relates), p_uri),
+                           (a_uri, URIRef(vivo.relates), w_uri),
+                           (a_uri, URIRef(vivo.rank), Literal(str(result["ranks"][w] + 1), datatype=XSD.integer))]:
+                graph_name = "" if output_format == "ttl" else " <" + result["graph"] + ">"
+                lines.append(" ".join(x.n3() for x in triple) + graph_name + " .\n")
+        with open(university_file_name(result["name"], output_format), "a") as f:
+            f.writelines(lines)
+        n_triples += len(lines)
+    return n_triples
+
+
+def generate_universities(config, sections, seed):
+    """
+    Generate the universities of sections in parallel.  Concepts and journals are generated once, in the namespace of
+    the VIVO section, and shared by all universities.  Return the summary.
+    """
+    output_format = config.get("SDG", "multi_university_output", fallback="ttl").strip()
+    read_settings(config)
+    shared = Graph()
+    for prefix, namespace in prefixes:
+        shared.bind(prefix, namespace)
+    shared.add_vocabularies(config)
+
+    properties = {section: dict(config.items(section, raw=True)) for section in ["VIVO", "SDG"] + sections}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(sections)) as executor:
+        futures = [executor.submit(generate_university_worker, properties, section, index, seed,
+                                   [str(x) for x in concept_uris], [str(x) for x in journal_uris], output_format)
+                   for index, section in enumerate(sections)]
+        results = [future.result() for future in futures]
+
+    fraction = float(config.get("SDG", "cross_institution_coauthors", fallback="0"))
+    n_cross = add_cross_institution_coauthors(results, fraction, output_format)
+
+    # the shared vocabularies go to their own file, or to their own named graph ahead of the universities
+
+    university_files = [university_file_name(result["name"], output_format) for result in results]
+    if output_format == "ttl":
+        shared.write_output("sample-data-shared.ttl")
+    else:
+        shared.write_output("sample-data.nq", "nquads", ns)
+        with open("sample-data.nq", "a") as f:
+            for file_name in university_files:
+                with open(file_name) as part:
+                    shutil.copyfileobj(part, f)
+                os.remove(file_name)
+
+    n_triples = len(shared) + n_cross + sum(result["n_triples"] for result in results)
+    summary = "\n".join([result["summary"] for result in results] +
+                         [" ".join(str(x) for x in [len(results), "universities;", len(shared), "shared triples;",
+                                                   n_cross, "cross institution triples;", n_triples, "triples"])])
+    return summary
+
+
+def derive_outputs(config, sections, entry_dir, missing):
+    """
+    Make output files missing from a cache entry from the files it has.  A binary dump is made from sample-data.ttl.
+    With multiple universities, sample-data.nq is made from the Turtle files, and the Turtle files from sample-data.nq.
+    Return False if the entry does not have what is needed.
+    """
+    if not sections:
+        source = os.path.join(entry_dir, "sample-data.ttl")
+        if not os.path.isfile(source):
+            return False
+        for file_name in missing:
+            Graph().parse(source, format="turtle").write_binary_dump(file_name)
+        return True
+
+    graph_names = {"sample-data-shared.ttl": config.get("VIVO", "ns")}
+    for section in sections:
+        graph_names[university_file_name(section[len(UNIVERSITY_SECTION):].strip(), "ttl")] = \
+            config.get(section, "graph", fallback=config.get(section, "ns"))
+    if "sample-data.nq" in missing:
+        if any(not os.path.isfile(os.path.join(entry_dir, x)) for x in graph_names):
+            return False
+        open("sample-data.nq", "w").close()
+        for source, graph_name in graph_names.items():
+            Graph().parse(os.path.join(entry_dir, source), format="turtle").write_output(
+                "sample-data.nq", "nquads", graph_name, append=True)
+        return True
+
+    source = os.path.join(entry_dir, "sample-data.nq")
+    if not os.path.isfile(source):
+        return False
+    dataset = Dataset()
+    dataset.parse(source, format="nquads")
+    graphs = {}
+    for file_name in missing:
+        graphs[file_name] = Graph()
+        for triple in dataset.graph(URIRef(graph_names[file_name])):
+            graphs[file_name].add(triple)
+
+        # a graph that is not in the cached quads cannot be made, and must not be cached as an empty file
+
+        if len(graphs[file_name]) == 0:
+            return False
+    for file_name, graph in graphs.items():
+        for prefix, namespace in prefixes:
+            graph.bind(prefix, namespace)
+        graph.write_output(file_name)
+    return True
+
+
+def main():
+    start = time.time()
+    config = configparser.ConfigParser()
+    config.read("sdg.properties")
 
-        print(triples_string, file=f)
-        stop = time.time()
-        print(site_dns, "1 University;", n_colleges, "colleges;", n_departments, "departments;", n_people, "people;",
-            n_works, "works;", n_projects, "projects;", n_grants, "grants;", n_equipment, "units of equipment;", len(g), "triples in language", lang, "{:.2f} seconds".format(stop - start))
+    # with a seed, the output depends only on the properties, so identical runs can be served from the cache
+
+    seed = config.get("SDG", "seed", fallback="").strip()
+    cache_dir = config.get("SDG", "cache_dir", fallback="").strip()
+    binary_dump = config.get("SDG", "binary_dump", fallback="").strip()
+    sections = [x for x in config.sections() if x.startswith(UNIVERSITY_SECTION)]
+    if sections:
+        output_files = university_output_files(config, sections)
+    else:
+        output_files = ["sample-data.ttl"] + ([binary_dump] if binary_dump else [])
+    if len(set(os.path.basename(x) for x in output_files + ["summary.txt"])) < len(output_files) + 1:
+        raise ValueError("output files " + ", ".join(output_files) + " must have different file names")
+    cache_key = None
+    if seed:
+        random.seed(int(seed))
+        if cache_dir:
+            cache_key = make_cache_key(config, seed)
+            summary = read_cache(cache_dir, cache_key, output_files,
+                                 lambda entry_dir, missing: derive_outputs(config, sections, entry_dir, missing))
+            if summary is not None:
+                print(summary, "(cached, {:.2f} seconds)".format(time.time() - start))
+                return
+
+    if sections:
+        summary = generate_universities(config, sections, seed)
+    else:
+        read_settings(config)
+
+        # bind prefixes explicitly.  Otherwise rdflib numbers them in hash order, which differs from run to run
+
+        for prefix, namespace in prefixes:
+            g.bind(prefix, namespace)
+
+        g.add_vocabularies(config)
+        counts = g.generate_university(config)
+        g.write_output("sample-data.ttl")
+
+        if binary_dump:
+            g.write_binary_dump(binary_dump)
+
+        summary = make_summary(counts, len(g))
+
+    if cache_key is not None:
+        write_cache(cache_dir, cache_key, output_files, summary)
+    stop = time.time()
+    print(summary, "{:.2f} seconds".format(stop - start))
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Generate VIVO sample data as set in sdg.properties, or convert a "
+                                                 "binary dump written by an earlier run.")
+    parser.add_argument("--convert", metavar="DUMP", help="convert the binary dump DUMP instead of generating data")
+    parser.add_argument("--format", choices=["nt", "ttl"], default="nt", help="output format of the conversion")
+    parser.add_argument("--chunk-triples", type=int, default=0,
+                        help="split the conversion into files of at most this many triples")
+    parser.add_argument("--output", default="sample-data", help="output file name of the conversion, without extension")
+    args = parser.parse_args()
+    if args.convert:
+        start = time.time()
+        for file_name in convert_binary_dump(args.convert, args.output, args.format, args.chunk_triples):
+            print("Wrote", file_name)
+        print("{:.2f} seconds".format(time.time() - start))
+    else:
+        main()